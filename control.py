@@ -0,0 +1,303 @@
+import asyncio
+import json
+import math
+import os
+import pickle
+import random
+import stat
+import threading
+import time
+from collections import deque
+import params
+
+# Buckets used for the resource distributions
+HISTOGRAM_BINS = 10
+
+# Seconds between idle callbacks while paused
+PAUSE_POLL = 0.05
+
+# Seconds to wait for the server thread when closing
+CLOSE_TIMEOUT = 5
+
+
+class Controller:
+    """
+    Local control endpoint of a running simulation.
+
+    Listens on a Unix socket for line based commands and answers with one
+    JSON object per line. The server runs an asyncio loop in a background
+    thread, while the commands are executed by the turn loop between turns,
+    so the world is never touched mid turn.
+
+    Commands:
+        metrics             Current turn, population, turns/sec & resources
+        pause               Pause the simulation
+        resume              Resume the simulation
+        step [n]            Run n more turns while paused (default 1)
+        delay <seconds>     Change the delay between turns
+        checkpoint [path]   Save the simulation state to a file
+        stop                End the simulation
+    """
+
+    def __init__(self, path, delay=0, turn=0):
+        self.path = path
+        self.delay = delay
+        self.paused = False
+        self.stopped = False
+        self.steps = 0
+
+        # Commands waiting for the turn loop
+        self.requests = deque()
+        self.wakeup = threading.Event()
+
+        # Turn rate measurements, starting from the first turn of the run
+        self.last_sample = (time.monotonic(), turn)
+
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+        # Tasks serving the connected clients
+        self.clients = set()
+
+        # Raised by the server thread while starting
+        self.error = None
+
+    def start(self):
+        """
+        Starts listening on the socket in a background thread.
+        """
+        # Only replace a stale socket, never another file
+        if os.path.exists(self.path):
+            if not stat.S_ISSOCK(os.stat(self.path).st_mode):
+                raise FileExistsError("{0} exists and is not a socket".format(self.path))
+            os.remove(self.path)
+
+        ready = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self.listen(ready),), daemon=True)
+        self.thread.start()
+        ready.wait()
+
+        if self.error:
+            self.thread.join()
+            raise self.error
+
+    def close(self):
+        """
+        Stops the server and removes the socket.
+        """
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.shutdown)
+            self.thread.join(CLOSE_TIMEOUT)
+            self.loop = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    # Turn loop side --------------------------------------------------
+
+    def serve(self, world, turn, population, idle=None):
+        """
+        Executes the pending commands. Blocks while the simulation is
+        paused and no steps are requested.
+
+        :param world: The world simulation
+        :param turn: Number of turns completed
+        :param population: The population buffer
+        :param idle: Called regularly while paused, returns True to stop the simulation
+        """
+        self.handle_requests(world, turn, population)
+
+        while self.paused and not self.steps and not self.stopped:
+            if self.wakeup.wait(PAUSE_POLL):
+                self.wakeup.clear()
+                self.handle_requests(world, turn, population)
+            if idle and idle():
+                self.stopped = True
+
+        # Steps only count the turns run while paused
+        if self.paused and self.steps:
+            self.steps -= 1
+
+    def handle_requests(self, world, turn, population):
+        """
+        Runs the queued commands and sends back their replies.
+        """
+        while self.requests:
+            command, args, reply = self.requests.popleft()
+            try:
+                result = self.execute(command, args, world, turn, population)
+                result["ok"] = True
+            except (ValueError, TypeError, OSError) as e:
+                result = {"ok": False, "error": str(e)}
+            self.loop.call_soon_threadsafe(reply.set_result, result)
+
+    def execute(self, command, args, world, turn, population):
+        """
+        Executes a single command.
+
+        :return: A dict with the results of the command
+        """
+        if command == "metrics":
+            return self.metrics(world, turn)
+        elif command == "pause":
+            self.paused = True
+        elif command == "resume":
+            self.paused = False
+            self.steps = 0
+        elif command == "step":
+            if not self.paused:
+                raise ValueError("step needs a paused simulation")
+            steps = int(args[0]) if args else 1
+            if steps <= 0:
+                raise ValueError("step needs a positive number of turns")
+            self.steps += steps
+        elif command == "delay":
+            delay = float(args[0]) if args else -1
+            if not math.isfinite(delay) or delay < 0:
+                raise ValueError("delay needs a non-negative number of seconds")
+            self.delay = delay
+        elif command == "checkpoint":
+            path = args[0] if args else "checkpoint_{0}.pkl".format(turn)
+            save_checkpoint(path, world, turn, population)
+            return {"path": os.path.abspath(path)}
+        elif command == "stop":
+            self.stopped = True
+        else:
+            raise ValueError("unknown command: {0}".format(command))
+
+        return {}
+
+    def metrics(self, world, turn):
+        """
+        Collects the current statistics of the simulation.
+        The turn rate is measured since the previous query.
+        """
+        now = time.monotonic()
+        then, last_turn = self.last_sample
+        self.last_sample = (now, turn)
+
+        blips = list(world.blips)
+        return {
+            "turn": turn,
+            "population": len(blips),
+            "turns_per_sec": (turn - last_turn) / (now - then) if now > then else 0,
+            "paused": self.paused,
+            "delay": self.delay,
+            "strength": distribution([b.strength for b in blips], params.MAX_RES),
+            "vapors": distribution([b.vapors for b in blips], params.MAX_RES),
+            "age": distribution([b.age for b in blips], params.MAX_LIFE),
+            "food": sum(world.map[y][x].value for x, y in world.food_tiles),
+        }
+
+    # Server side -----------------------------------------------------
+
+    async def listen(self, ready):
+        """
+        Accepts clients until the server is closed.
+        """
+        try:
+            self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+            self.loop = asyncio.get_running_loop()
+        except Exception as e:
+            # Reported by start in the main thread
+            self.error = e
+            return
+        finally:
+            ready.set()
+
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def shutdown(self):
+        """
+        Disconnects the clients and stops accepting new ones.
+        Runs in the server thread.
+        """
+        # The server waits for open connections before closing
+        for task in self.clients:
+            task.cancel()
+        self.server.close()
+
+    async def handle_client(self, reader, writer):
+        """
+        Forwards the commands of a client to the turn loop.
+        """
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                words = line.decode().split()
+                if not words:
+                    continue
+
+                # Wait for the turn loop to execute the command
+                reply = self.loop.create_future()
+                self.requests.append((words[0].lower(), words[1:], reply))
+                self.wakeup.set()
+                result = await reply
+
+                writer.write((json.dumps(result) + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.clients.discard(task)
+            writer.close()
+
+
+def distribution(values, high, bins=HISTOGRAM_BINS):
+    """
+    Summarizes a list of values.
+
+    :param values: The values to summarize
+    :param high: Upper bound of the histogram, bigger values go in the last bin
+    :param bins: Number of histogram bins
+    :return: A dict with the min, mean, max and histogram of the values
+    """
+    histogram = [0 for _ in range(bins)]
+    for v in values:
+        histogram[max(0, min(int(v * bins / high), bins - 1))] += 1
+
+    if not values:
+        return {"min": 0, "mean": 0, "max": 0, "histogram": histogram}
+    return {"min": min(values), "mean": sum(values) / len(values), "max": max(values), "histogram": histogram}
+
+
+def save_checkpoint(path, world, turn, population):
+    """
+    Saves the state of the simulation, including the random
+    generator and the parameters, so it can be resumed exactly.
+    """
+    state = {
+        "world": world,
+        "turn": turn,
+        "population": population,
+        "random": random.getstate(),
+        "params": {k: v for k, v in vars(params).items() if k.isupper()},
+    }
+
+    # Write to a temporary file so a crash never leaves a broken checkpoint
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    """
+    Restores a simulation saved with save_checkpoint.
+
+    :return: A tuple (world, turn, population)
+    """
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+
+    vars(params).update(state["params"])
+    random.setstate(state["random"])
+    return state["world"], state["turn"], state["population"]
@@ -2,6 +2,8 @@ import pygame
 import params
 import argparse
 import time
+import control
+import mapcache
 from world import World
 
 # Colors
@@ -123,14 +125,28 @@ class BoardRenderer:
         self.window.blit(text, text_rec)
 
 
-def init_game():
+def init_game(cache_dir=None):
     """
     Creates a new BoardRenderer to display the game and
     a new World to simulate the game.
 
+    :param cache_dir: Directory of the precomputed maps, None to disable the cache
     :return: A tuple (BoardRenderer, Word)
     """
-    return BoardRenderer('LifeSim', GRID_SIZE, BLOCK_SIZE), World(GRID_SIZE, LAKE_SIZE, FOREST_WIDTH)
+    return BoardRenderer('LifeSim', GRID_SIZE, BLOCK_SIZE), World(GRID_SIZE, LAKE_SIZE, FOREST_WIDTH, cache_dir)
+
+
+def quit_requested():
+    """
+    Processes the window events.
+
+    :return: True if the window was closed
+    """
+    done = False
+    for event in pygame.event.get():
+        if event.type == pygame.QUIT:
+            done = True
+    return done
 
 
 def main():
@@ -139,6 +155,12 @@ def main():
     parser.add_argument("-s", "--simple", help="Don't display graphics", action="store_true")
     parser.add_argument("-d", "--delay", help="Delay between turns", type=float)
     parser.add_argument("-p", "--parameters_file", help="Load parameters from the given file")
+    parser.add_argument("-c", "--cache_dir", help="Cache the precomputed maps in the given directory "
+                        "(default " + mapcache.DEFAULT_CACHE_DIR + ")", nargs="?", const=mapcache.DEFAULT_CACHE_DIR)
+    parser.add_argument("-u", "--control_socket", help="Listen for control commands on the given Unix socket")
+    parser.add_argument("-r", "--resume", help="Resume the simulation from the given checkpoint")
+    parser.add_argument("-w", "--workers", help="Update the blips in parallel with the given number of workers", type=int)
+    parser.add_argument("--threads", help="Use worker threads instead of processes", action="store_true")
 
     # Parse args
     args = parser.parse_args()
@@ -151,23 +173,34 @@ def main():
         params.read_params(args.parameters_file)
 
     # Start the game
-    renderer, world = init_game()
+    renderer, world = init_game(args.cache_dir)
 
     turn = 0
     population = [0 for _ in range(params.MAX_LIFE)]
+    if args.resume:
+        world, turn, population = control.load_checkpoint(args.resume)
+
+    # Start the parallel workers
+    pool = None
+    if args.workers:
+        pool = world.create_pool(args.workers, args.threads)
+
+    # Listen for commands
+    controller = None
+    if args.control_socket:
+        controller = control.Controller(args.control_socket, delay, turn)
+        controller.start()
+
     done = False
     while not done:
         # Get input
-        events = pygame.event.get()
-        for event in events:
-            if event.type == pygame.QUIT:
-                    done = True
+        done = quit_requested()
 
         # Prepare the next turn
         world.turn_start()
 
         # Update the world
-        world.update()
+        world.update(pool)
 
         # Complete the current turn
         world.turn_end()
@@ -197,9 +230,19 @@ def main():
         if current == 0:
             done = True
 
+        # Run the received commands
+        if controller:
+            controller.serve(world, turn, population, quit_requested)
+            done = done or controller.stopped
+            delay = controller.delay
+
         # Time between rounds
         time.sleep(delay)
 
+    if controller:
+        controller.close()
+    if pool:
+        pool.shutdown()
     pygame.quit()
 
 
@@ -0,0 +1,269 @@
+import array
+import hashlib
+import inspect
+import mmap
+import os
+import struct
+import tempfile
+
+# Default location of the cache files
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lifesim")
+
+# File layout: header, then for each of distances, terrain, water directions
+# and available directions a grid header, the chunk positions and the chunk data
+MAGIC = b"LSM2"
+HEADER = struct.Struct("<4s20sII")
+GRID_HEADER = struct.Struct("<c7xQQ")
+CHUNK_POS = struct.Struct("<II")
+
+# Chunks are squares of CHUNK_SIZE x CHUNK_SIZE tiles
+CHUNK_BITS = 6
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+
+# Marks a tile with no direction
+NO_DIRECTION = 0xFF
+
+
+class ChunkGrid:
+    """
+    A sparse 2D grid of typed values, indexed as grid[y][x].
+    The grid is split in square chunks, which are only allocated
+    once they hold a value other than the default.
+    """
+
+    def __init__(self, width, height, typecode, default=0):
+        self.width = width
+        self.height = height
+        self.typecode = typecode
+        self.default = default
+
+        # Chunk position -> array of CHUNK_SIZE * CHUNK_SIZE values
+        self.chunks = {}
+
+    def get(self, x, y):
+        chunk = self.chunks.get((x >> CHUNK_BITS, y >> CHUNK_BITS))
+        if chunk is None:
+            return self.default
+        return chunk[(y & CHUNK_MASK) << CHUNK_BITS | (x & CHUNK_MASK)]
+
+    def set(self, x, y, value):
+        key = (x >> CHUNK_BITS, y >> CHUNK_BITS)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            # Default values don't need storage
+            if value == self.default:
+                return
+            chunk = array.array(self.typecode, [self.default]) * (CHUNK_SIZE * CHUNK_SIZE)
+            self.chunks[key] = chunk
+        chunk[(y & CHUNK_MASK) << CHUNK_BITS | (x & CHUNK_MASK)] = value
+
+    def items(self):
+        """
+        Yields the tiles that don't hold the default value, in no particular order.
+
+        :return: A generator of tuples (x, y, value)
+        """
+        for (cx, cy), chunk in self.chunks.items():
+            for i, value in enumerate(chunk):
+                if value != self.default:
+                    x = cx << CHUNK_BITS | (i & CHUNK_MASK)
+                    y = cy << CHUNK_BITS | (i >> CHUNK_BITS)
+                    if x < self.width and y < self.height:
+                        yield x, y, value
+
+    def __getitem__(self, y):
+        if not 0 <= y < self.height:
+            raise IndexError("grid row out of range")
+        return ChunkRow(self, y)
+
+    def __len__(self):
+        return self.height
+
+    def __getstate__(self):
+        # Memory views can't be pickled, save a copy of the chunks
+        state = dict(self.__dict__)
+        state["chunks"] = {k: array.array(self.typecode, bytes(c)) for k, c in self.chunks.items()}
+        return state
+
+
+class ChunkRow:
+    """
+    A row of a ChunkGrid, so tiles keep the grid[y][x] access.
+    """
+    __slots__ = ("grid", "y")
+
+    def __init__(self, grid, y):
+        self.grid = grid
+        self.y = y
+
+    def __getitem__(self, x):
+        return self.grid.get(x, self.y)
+
+    def __setitem__(self, x, value):
+        self.grid.set(x, self.y, value)
+
+    def __len__(self):
+        return self.grid.width
+
+
+class MapFields:
+    """
+    The static data of a map, which only depends on its layout.
+
+    terrain:    Tile type codes
+    distance:   Shortest distance to water from each tile
+    water_dir:  Direction code leading to water from each tile
+    available:  Bitmask of the valid moves from each tile
+    """
+
+    def __init__(self, terrain, distance, water_dir, available):
+        self.terrain = terrain
+        self.distance = distance
+        self.water_dir = water_dir
+        self.available = available
+
+
+def distance_typecode(limit):
+    """
+    Returns the smallest array typecode that holds distances up to limit,
+    keeping its max value free as the unreachable marker.
+    """
+    for typecode in "BHI":
+        if limit < (1 << (8 * array.array(typecode).itemsize)) - 1:
+            return typecode
+    return "Q"
+
+
+def source_digest(*items):
+    """
+    Hashes the code of the given functions & classes and the repr of
+    the given constants. Used as the cache version, so any change in
+    map generation or in the encoding of the fields invalidates the old files.
+    """
+    h = hashlib.sha1()
+    for item in items:
+        if not callable(item):
+            h.update(repr(item).encode())
+            continue
+        try:
+            h.update(inspect.getsource(item).encode())
+        except (OSError, TypeError):
+            # No source available, hash the compiled code instead
+            if inspect.isclass(item):
+                codes = [f.__code__ for _, f in sorted(vars(item).items()) if hasattr(f, "__code__")]
+            else:
+                codes = [item.__code__]
+            for code in codes:
+                hash_code(h, code)
+    return h.digest()
+
+
+def hash_code(h, code):
+    """
+    Adds a code object and the ones nested in it to a hash.
+    """
+    h.update(code.co_code)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            hash_code(h, const)
+        else:
+            h.update(repr(const).encode())
+
+
+def encoding():
+    """
+    The code & constants that define how the fields are stored.
+    """
+    return (ChunkGrid, distance_typecode, load, store, MAGIC, HEADER.format, GRID_HEADER.format,
+            CHUNK_POS.format, CHUNK_BITS, NO_DIRECTION)
+
+
+def cache_path(cache_dir, key):
+    """
+    :param key: A tuple (width, height, lake_size, lake_start, forest_width, see_range)
+    """
+    return os.path.join(cache_dir, "map_{0}x{1}_lake{2}at{3}_forest{4}_range{5}.bin".format(*key))
+
+
+def load(cache_dir, key, version):
+    """
+    Maps the cached fields of a map into memory.
+
+    :param cache_dir: Directory holding the cache files
+    :param key: A tuple (width, height, lake_size, lake_start, forest_width, see_range)
+    :param version: Digest of the map generation code
+    :return: MapFields backed by the file, None if missing or outdated
+    """
+    width, height = key[0], key[1]
+    try:
+        with open(cache_path(cache_dir, key), "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    # Check the file matches the current map generation
+    try:
+        magic, digest, w, h = HEADER.unpack_from(buf)
+        if magic != MAGIC or digest != version or (w, h) != (width, height):
+            return None
+
+        # Slice the chunks without copying
+        view = memoryview(buf)
+        offset = HEADER.size
+        grids = []
+        for _ in range(4):
+            typecode, default, count = GRID_HEADER.unpack_from(buf, offset)
+            grid = ChunkGrid(width, height, typecode.decode(), default)
+            offset += GRID_HEADER.size
+
+            positions = list(CHUNK_POS.iter_unpack(view[offset:offset + count * CHUNK_POS.size]))
+            offset += count * CHUNK_POS.size
+
+            size = CHUNK_SIZE * CHUNK_SIZE * array.array(grid.typecode).itemsize
+            for pos in positions:
+                grid.chunks[pos] = view[offset:offset + size].cast(grid.typecode)
+                offset += size
+            grids.append(grid)
+    except (struct.error, ValueError, TypeError):
+        return None
+
+    if offset != len(buf):
+        return None
+
+    distance, terrain, water_dir, available = grids
+    return MapFields(terrain, distance, water_dir, available)
+
+
+def store(cache_dir, key, version, fields):
+    """
+    Writes the fields of a map to the cache. The file is replaced atomically
+    so parallel runs never see a partial write.
+
+    :param cache_dir: Directory holding the cache files
+    :param key: A tuple (width, height, lake_size, lake_start, forest_width, see_range)
+    :param version: Digest of the map generation code
+    :param fields: The MapFields to save
+    """
+    width, height = key[0], key[1]
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, version, width, height))
+                for grid in (fields.distance, fields.terrain, fields.water_dir, fields.available):
+                    positions = sorted(grid.chunks)
+                    f.write(GRID_HEADER.pack(grid.typecode.encode(), grid.default, len(positions)))
+                    for pos in positions:
+                        f.write(CHUNK_POS.pack(*pos))
+                    for pos in positions:
+                        f.write(grid.chunks[pos])
+            os.replace(tmp, cache_path(cache_dir, key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+    except OSError:
+        # The cache is only an optimization
+        pass
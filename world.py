@@ -1,5 +1,8 @@
+import array
 import random
-import queue
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import mapcache
 import params
 
 # Directions
@@ -9,6 +12,11 @@ EAST = "east"
 WEST = "west"
 DIRECTIONS = {NORTH: (0, -1), SOUTH: (0, 1), WEST: (-1, 0), EAST: (1, 0)}
 OPPOSITE = {NORTH: SOUTH, SOUTH: NORTH, WEST: EAST, EAST: WEST}
+DIRECTION_CODES = list(DIRECTIONS)
+
+# Available directions for each bitmask of valid moves
+AVAILABLE_SETS = [[d for i, d in enumerate(DIRECTION_CODES) if mask & (1 << i)]
+                  for mask in range(1 << len(DIRECTION_CODES))]
 
 # State index
 AVAILABLE = 0
@@ -26,13 +34,88 @@ EAT = "consume"
 NORMAL = "normal"
 WATER = "water"
 FOREST = "forest"
+TERRAIN_CODES = [NORMAL, WATER, FOREST]
 
 
 class MapTile:
-    def __init__(self):
-        self.type = NORMAL
-        self.blips = []
-        self.value = 0
+    """
+    A view of a single tile of the map.
+    """
+    __slots__ = ("tiles", "x", "y")
+
+    def __init__(self, tiles, x, y):
+        self.tiles = tiles
+        self.x = x
+        self.y = y
+
+    @property
+    def type(self):
+        return TERRAIN_CODES[self.tiles.terrain.get(self.x, self.y)]
+
+    @property
+    def value(self):
+        return self.tiles.food.get(self.x, self.y)
+
+    @value.setter
+    def value(self, value):
+        self.tiles.food.set(self.x, self.y, value)
+
+    @property
+    def blips(self):
+        return self.tiles.blips.get((self.x, self.y), ())
+
+
+class TileMap:
+    """
+    Sparse storage for the tiles of the map, indexed as map[y][x].
+    Tile types and food are kept in chunked arrays, blips are
+    only indexed for the tiles they stand on.
+    """
+
+    def __init__(self, terrain, food):
+        self.width = terrain.width
+        self.height = terrain.height
+        self.terrain = terrain
+        self.food = food
+
+        # Position -> list of blips on the tile
+        self.blips = {}
+
+    def add_blip(self, position, blip):
+        self.blips.setdefault(position, []).append(blip)
+
+    def remove_blip(self, position, blip):
+        tile = self.blips[position]
+        tile.remove(blip)
+        if not tile:
+            del self.blips[position]
+
+    def __getitem__(self, y):
+        if not 0 <= y < self.height:
+            raise IndexError("map row out of range")
+        return TileRow(self, y)
+
+    def __len__(self):
+        return self.height
+
+
+class TileRow:
+    """
+    A row of the map.
+    """
+    __slots__ = ("tiles", "y")
+
+    def __init__(self, tiles, y):
+        self.tiles = tiles
+        self.y = y
+
+    def __getitem__(self, x):
+        if not 0 <= x < self.tiles.width:
+            raise IndexError("map column out of range")
+        return MapTile(self.tiles, x, self.y)
+
+    def __len__(self):
+        return self.tiles.width
 
 
 class Blip:
@@ -41,7 +124,8 @@ class Blip:
     """
     EXPLORE_CHANCE = 0.25
 
-    def __init__(self, lifetime):
+    def __init__(self, lifetime, uid=0):
+        self.id = uid
         self.lifetime = lifetime
         self.age = 0
         self.strength = params.MAX_RES
@@ -50,15 +134,16 @@ class Blip:
         self.due_time = 0
         self.threshold = max(params.MAX_RES / 2, params.BUDDING_MIN_RES)
 
-    def decide_action(self, state):
+    def decide_action(self, state, rng=random):
         """
         Decides the next action of the blip based on its current state
         :param state: A tuple (available directions, direction to water, direction to other blips)
+        :param rng: The random generator used for the decision
         :return: A tuple (move type from [MOVE, STAY, EAT], arg)
         """
         # If it's old it just wanders around till it's dead
         if self.age > params.MAX_BUDDING_AGE:
-            return MOVE, random.choice(state[AVAILABLE])
+            return MOVE, rng.choice(state[AVAILABLE])
 
         # Go to the center to make the baby
         if self.pregnant:
@@ -83,17 +168,17 @@ class Blip:
             if not state[IN_FOREST] and EAST in state[AVAILABLE]:
                 return MOVE, EAST
             else:
-                if random.random() < 0.5:
-                    return MOVE, random.choice(state[AVAILABLE])
+                if rng.random() < 0.5:
+                    return MOVE, rng.choice(state[AVAILABLE])
                 else:
                     return EAT, params.BUDDING_MIN_RES - self.strength + params.POWER_TO_STAY
 
 
         # If I'm ok, then wander around or explore the rest of the map
-        if random.random() < Blip.EXPLORE_CHANCE:
+        if rng.random() < Blip.EXPLORE_CHANCE:
             return MOVE, WEST
         else:
-            return MOVE, random.choice(state[AVAILABLE])
+            return MOVE, rng.choice(state[AVAILABLE])
 
     def get_status(self):
         """
@@ -110,32 +195,42 @@ class World:
     Controls and executes the commands of the blips.
     """
 
-    def __init__(self, dimensions, lake_size, forest_width):
+    def __init__(self, dimensions, lake_size, forest_width, cache_dir=None):
         self.width, self.height = dimensions
         self.lake_size = lake_size
         self.forest_width = forest_width
 
+        # Turn counter & seed of the parallel update
+        self.turn = 0
+        self.seed = None
+        self.workers = 1
+        self.next_id = 0
+
         # Quick access for tiles
         self.blips = {}
         self.food_tiles = []
         self.water_tiles = []
 
-        # Init map
-        self.map = [[MapTile() for _ in range(self.width)] for _ in range(self.height)]
+        # Load the static map data from the cache if available
+        lake_start = random.randint(0, self.height - lake_size)
+        key = (self.width, self.height, lake_size, lake_start, forest_width, params.SEE_RANGE)
+        fields = None
+        if cache_dir:
+            fields = mapcache.load(cache_dir, key, MAP_VERSION)
 
-        # Assign Forest Tiles in the East
-        for y in range(self.height):
-            for x in range(self.width - forest_width, self.width):
-                self.map[y][x].value = params.FOOD_SIZE
-                self.map[y][x].type = FOREST
-                self.food_tiles.append((x, y))
+        if fields:
+            self.terrain = fields.terrain
+        else:
+            self.terrain = self.generate_terrain(lake_start)
 
-        # Create lake in the West
-        lake_start = random.randint(0, self.height - lake_size)
-        for y in range(lake_size):
-            for x in range(lake_size):
-                self.map[lake_start + y][x].type = WATER
-                self.water_tiles.append((x, lake_start + y))
+        # Init map, only forest & water tiles need storage
+        self.map = TileMap(self.terrain, mapcache.ChunkGrid(self.width, self.height, "i"))
+        for x, y, code in sorted(self.terrain.items(), key=lambda t: (t[1], t[0])):
+            if TERRAIN_CODES[code] == FOREST:
+                self.map.food.set(x, y, params.FOOD_SIZE)
+                self.food_tiles.append((x, y))
+            elif TERRAIN_CODES[code] == WATER:
+                self.water_tiles.append((x, y))
 
         # Init blips
         for i in range(params.INIT_POP):
@@ -149,12 +244,20 @@ class World:
 
             self.spawn_blip((x, y))
 
-        # Compute shortest distance
-        # to water from each tile
-        self.water_distance = None
-        for y in range(lake_size):
-            for x in range(lake_size):
-                self.water_distance = self.compute_distances((x, lake_start + y), self.water_distance)
+        # Compute shortest distance to water
+        # & the valid moves from each tile
+        if not fields:
+            fields = self.compute_fields(self.terrain)
+            if cache_dir:
+                mapcache.store(cache_dir, key, MAP_VERSION, fields)
+
+        # Where the parallel workers find the map
+        self.fields = fields
+        self.cache = (cache_dir, key) if cache_dir else None
+
+        self.water_distance = fields.distance
+        self.water_directions = fields.water_dir
+        self.available_directions = fields.available
 
     def turn_start(self):
         """
@@ -166,13 +269,20 @@ class World:
                 self.try_to_get_pregnant(blip)
 
         # Restock food
+        food = self.map.food
         for x, y in self.food_tiles:
-            self.map[y][x].value = min(self.map[y][x].value + params.FOOD_BUILD, params.FOOD_SIZE)
+            food.set(x, y, min(food.get(x, y) + params.FOOD_BUILD, params.FOOD_SIZE))
 
-    def update(self):
+    def update(self, pool=None):
         """
         Processes the actions of the blips.
+
+        :param pool: An executor from create_pool to update the blips in parallel
         """
+        if pool:
+            self.update_parallel(pool)
+            return
+
         states = {}
         for blip in self.blips.keys():
             states[blip] = self.build_state(blip)
@@ -189,10 +299,87 @@ class World:
             elif c[0] == EAT:
                 self.consume(blip, c[1])
 
+    def update_parallel(self, pool):
+        """
+        Processes the actions of the blips in parallel.
+
+        Each blip decides with its own random generator and food on shared
+        tiles is split by share_food, so the outcome doesn't depend on
+        the order of the blips or on the number of workers.
+
+        :param pool: An executor from create_pool
+        """
+        if self.seed is None:
+            self.seed = random.getrandbits(64)
+
+        # Blips are kept in spawn order, which is also id order
+        pairs = list(self.blips.items())
+        if not pairs:
+            return
+
+        # Threads share the world, processes get a copy of their blips.
+        # Both sense the others through the same snapshot of positions
+        world = self if isinstance(pool, ThreadPoolExecutor) else None
+        positions = tuple(self.blips.values())
+        size = -(-len(pairs) // self.workers)
+        tasks = [pool.submit(resolve_partition, world, pairs[start:start + size], positions, self.seed, self.turn)
+                 for start in range(0, len(pairs), size)]
+
+        # Wait for every partition, threads still read the world until then
+        results = [effect for task in tasks for effect in task.result()]
+
+        # Apply moves & costs, collect food requests per tile
+        requests = {}
+        for (blip, pos), (new_pos, strength, vapors, food) in zip(pairs, results):
+            if new_pos != pos:
+                self.blips[blip] = new_pos
+                self.map.remove_blip(pos, blip)
+                self.map.add_blip(new_pos, blip)
+            blip.strength += strength
+            blip.vapors += vapors
+            if food:
+                requests.setdefault(new_pos, []).append((food, blip))
+
+        # Split the food of contested tiles
+        for (x, y), eaters in requests.items():
+            tile = self.map[y][x]
+            grants = share_food(tile.value, [(food, blip.id) for food, blip in eaters])
+            for (_, blip), grant in zip(eaters, grants):
+                blip.strength += grant
+                tile.value -= grant
+
+    def create_pool(self, workers, threads=False):
+        """
+        Creates the executor used by the parallel update.
+        Worker processes map the cached fields, or get a copy of them if
+        the cache is disabled or couldn't be written.
+
+        Threads give the same results, but the GIL runs them one at
+        a time, so they're only useful to check the parallel update.
+
+        :param workers: Number of workers
+        :param threads: Use threads instead of processes
+        """
+        self.workers = workers
+        if threads:
+            return ThreadPoolExecutor(workers)
+
+        # Only point the workers to files that can be mapped
+        cache = self.cache
+        if cache and not mapcache.load(cache[0], cache[1], MAP_VERSION):
+            cache = None
+
+        fields = None if cache else self.fields
+        settings = {k: v for k, v in vars(params).items() if k.isupper()}
+        return ProcessPoolExecutor(workers, initializer=init_worker,
+                                   initargs=((self.width, self.height), cache, fields, settings))
+
     def turn_end(self):
         """
         End of turn calculations.
         """
+        self.turn += 1
+
         # Age blips
         for blip in self.blips.keys():
             blip.age += 1
@@ -247,8 +434,8 @@ class World:
 
         # Update pos
         self.blips[blip] = new_pos
-        self.map[y][x].blips.remove(blip)
-        self.map[y + dy][x + dx].blips.append(blip)
+        self.map.remove_blip((x, y), blip)
+        self.map.add_blip(new_pos, blip)
 
         # Update params
         if blip.pregnant:
@@ -286,9 +473,7 @@ class World:
         self.stay(blip)
 
         # Drink water
-        for _, (dx, dy) in DIRECTIONS.items():
-            if (x + dx, y + dy) in self.water_tiles:
-                blip.vapors += quantity
+        blip.vapors += quantity * self.count_water((x, y))
 
         # Consume the available food
         if self.map[y][x].value >= quantity:
@@ -298,6 +483,34 @@ class World:
             blip.strength += self.map[y][x].value
             self.map[y][x].value = 0
 
+    def resolve_action(self, blip, command, arg):
+        """
+        Computes the effects of an action without applying them.
+        Food is only requested, since other blips may compete for it.
+
+        :param blip: The blip that does the action
+        :param command: Move type from [MOVE, STAY, EAT]
+        :param arg: Argument of the move
+        :return: A tuple (new position, strength change, vapors change, food request)
+        """
+        x, y = self.blips[blip]
+        if blip.pregnant:
+            factor = params.BUD_FACTOR
+        else:
+            factor = 1
+
+        if command == MOVE and arg:
+            dx, dy = DIRECTIONS[arg]
+            if self.is_valid((x + dx, y + dy)):
+                return (x + dx, y + dy), -factor * params.POWER_TO_MOVE, -factor * params.VAPOUR_TO_MOVE, 0
+
+        # Invalid moves stay put
+        strength = -factor * params.POWER_TO_STAY
+        vapors = -factor * params.VAPOUR_TO_STAY
+        if command == EAT:
+            return (x, y), strength, vapors + arg * self.count_water((x, y)), arg
+        return (x, y), strength, vapors, 0
+
     # Blip management -------------------------------------------------
 
     def spawn_blip(self, pos):
@@ -312,8 +525,9 @@ class World:
         lifespan = params.MAX_LIFE - random.randint(0, int(params.AGE_VAR * scale))
 
         # Create blip and place it on the map
-        blip = Blip(lifespan)
-        self.map[y][x].blips.append(blip)
+        blip = Blip(lifespan, self.next_id)
+        self.next_id += 1
+        self.map.add_blip(pos, blip)
         self.blips[blip] = pos
 
     def kill_blip(self, blip):
@@ -322,7 +536,7 @@ class World:
         """
         if blip in self.blips:
             x, y = self.blips[blip]
-            self.map[y][x].blips.remove(blip)
+            self.map.remove_blip((x, y), blip)
             del self.blips[blip]
 
     def try_to_get_pregnant(self, blip):
@@ -343,16 +557,18 @@ class World:
 
     # Blip states -----------------------------------------------------
 
-    def build_state(self, blip):
+    def build_state(self, blip, positions=None):
         """
         Builds the current info for the blip
 
+        :param positions: Positions of all the blips, defaults to the current ones
         :return: A tuple (available_directions, direction_to_water, direction_to_others)
         """
-        available = [d for d, _ in self.get_neighbours(self.blips[blip])]
-        in_forest = self.blips[blip] in self.food_tiles
+        x, y = self.blips[blip]
+        available = AVAILABLE_SETS[self.available_directions.get(x, y)]
+        in_forest = TERRAIN_CODES[self.terrain.get(x, y)] == FOREST
 
-        return available, self.sense_water(blip), self.sense_friends(blip), in_forest, self.sense_center(blip)
+        return available, self.sense_water(blip), self.sense_friends(blip, positions), in_forest, self.sense_center(blip)
 
     def sense_center(self, blip):
         """
@@ -383,33 +599,32 @@ class World:
         x, y = self.blips[blip]
 
         # Check if water is in range
-        if self.water_distance[y][x] > params.SEE_RANGE:
+        if self.water_distance.get(x, y) > params.SEE_RANGE:
             return None
 
-        # Return the direction to water
-        # if a water tile is a neighbour
-        for d, (dx, dy) in DIRECTIONS.items():
-            if (x + dx, y + dy) in self.water_tiles:
-                return d
-
-        # Choose the neighbour on the shortest path to water
-        neighbours_dist = [(d, self.water_distance[pos[1]][pos[0]]) for d, pos in self.get_neighbours((x, y))]
-        return min(neighbours_dist, key=lambda t: t[1])[0]
+        # Precomputed direction on the shortest path to water
+        code = self.water_directions.get(x, y)
+        if code == mapcache.NO_DIRECTION:
+            return None
+        return DIRECTION_CODES[code]
 
-    def sense_friends(self, blip):
+    def sense_friends(self, blip, positions=None):
         """
         Computes the direction that leads to the most blips.
         The other blips must be in SEE_RANGE
 
         :param blip: The blip that does the query
+        :param positions: Positions of all the blips, defaults to the current ones
         :return: A direction from [NORTH, SOUTH, EAST, WEST],
                 None if no blips are in range
         """
         x, y = self.blips[blip]
+        if positions is None:
+            positions = self.blips.values()
 
         # Get all the blips in SEE_RANGE
         range_test = lambda pos: 0 < abs(pos[1] - y) + abs(pos[0] - x) <= params.SEE_RANGE
-        nearby_blips = list(filter(range_test, self.blips.values()))
+        nearby_blips = list(filter(range_test, positions))
 
         if not nearby_blips:
             return None
@@ -431,41 +646,113 @@ class World:
         Verifies if a position is contained in the grid and not a water tile.
         """
         x, y = position
-        return 0 <= x < self.width and 0 <= y < self.height and self.map[y][x].type != WATER
+        return 0 <= x < self.width and 0 <= y < self.height and TERRAIN_CODES[self.terrain.get(x, y)] != WATER
 
-    def compute_distances(self, start, costs=None):
+    def count_water(self, position):
+        """
+        Counts the water tiles next to a position.
         """
-        Computes the distance from start to all the other points on the map.
+        x, y = position
+        return sum(1 for dx, dy in DIRECTIONS.values()
+                   if 0 <= x + dx < self.width and 0 <= y + dy < self.height
+                   and TERRAIN_CODES[self.terrain.get(x + dx, y + dy)] == WATER)
 
-        :param start:   A tuple (x, y) representing start point.
-        :param costs:   An optional initial value for the costs array
-        :return:    A 2D array of costs.
+    def compute_distances(self, starts, limit=None):
         """
-        # Get starting points
-        x, y = start
+        Computes the distance from the closest start point
+        to all the other points on the map.
 
-        # Init cost array
-        if costs is None:
-            costs = [[float('Inf') for _ in range(self.width)] for _ in range(self.height)]
+        :param starts:  A list of tuples (x, y) representing start points.
+        :param limit:   Stop at this distance, None to cover the whole map.
+        :return:    A 2D grid of costs, unreached tiles hold the max value of the grid type.
+        """
+        if limit is None:
+            limit = self.width + self.height
+        typecode = mapcache.distance_typecode(limit)
+        inf = (1 << (8 * array.array(typecode).itemsize)) - 1
+        costs = mapcache.ChunkGrid(self.width, self.height, typecode, inf)
 
-        # Add start point to queue
-        q = queue.Queue()
-        costs[y][x] = 0
-        q.put(start)
+        # Add start points to queue
+        q = deque()
+        for x, y in starts:
+            costs.set(x, y, 0)
+            q.append((x, y))
 
-        while not q.empty():
-            x, y = q.get()
+        while q:
+            x, y = q.popleft()
+            cost = costs.get(x, y) + 1
+            if cost > limit:
+                continue
 
             # Add neighbours to queue
-            neighbours = [pos for d, pos in self.get_neighbours((x, y))]
-            for nx, ny in neighbours:
+            for _, (nx, ny) in self.get_neighbours((x, y)):
                 # Only add if we can update the cost
-                if costs[ny][nx] > costs[y][x] + 1:
-                    costs[ny][nx] = costs[y][x] + 1
-                    q.put((nx, ny))
+                if costs.get(nx, ny) > cost:
+                    costs.set(nx, ny, cost)
+                    q.append((nx, ny))
 
         return costs
 
+    def generate_terrain(self, lake_start):
+        """
+        Lays out the map: forest tiles in the East and a lake in the West.
+
+        :param lake_start: The row of the lake's upper edge
+        :return: A 2D grid of tile type codes
+        """
+        terrain = mapcache.ChunkGrid(self.width, self.height, "B", TERRAIN_CODES.index(NORMAL))
+
+        # Assign Forest Tiles in the East
+        for y in range(self.height):
+            for x in range(self.width - self.forest_width, self.width):
+                terrain.set(x, y, TERRAIN_CODES.index(FOREST))
+
+        # Create lake in the West
+        for y in range(self.lake_size):
+            for x in range(self.lake_size):
+                terrain.set(x, lake_start + y, TERRAIN_CODES.index(WATER))
+
+        return terrain
+
+    def compute_fields(self, terrain):
+        """
+        Computes the static data of the map, used to sense the surroundings.
+        Water is only sensed in SEE_RANGE, so distances stop there.
+
+        :param terrain: The grid of tile type codes
+        :return: The MapFields of the map
+        """
+        water = {(x, y) for x, y, code in terrain.items() if TERRAIN_CODES[code] == WATER}
+        distance = self.compute_distances(water, params.SEE_RANGE)
+        water_dir = mapcache.ChunkGrid(self.width, self.height, "B", mapcache.NO_DIRECTION)
+        available = mapcache.ChunkGrid(self.width, self.height, "B", (1 << len(DIRECTION_CODES)) - 1)
+
+        # Moves are only blocked on the edges of the map and next to the water
+        edges = [(x, y) for x in range(self.width) for y in (0, self.height - 1)]
+        edges += [(x, y) for y in range(self.height) for x in (0, self.width - 1)]
+        edges += [(x + dx, y + dy) for x, y in water for dx, dy in DIRECTIONS.values()]
+        for x, y in edges:
+            if 0 <= x < self.width and 0 <= y < self.height:
+                mask = 0
+                for d, _ in self.get_neighbours((x, y)):
+                    mask |= 1 << DIRECTION_CODES.index(d)
+                available.set(x, y, mask)
+
+        for x, y, _ in distance.items():
+            neighbours = self.get_neighbours((x, y))
+
+            # Water is a neighbour
+            near = [d for d, (dx, dy) in DIRECTIONS.items() if (x + dx, y + dy) in water]
+            if near:
+                water_dir.set(x, y, DIRECTION_CODES.index(near[0]))
+
+            # Choose the neighbour on the shortest path to water
+            elif neighbours:
+                d = min(neighbours, key=lambda t: distance.get(*t[1]))[0]
+                water_dir.set(x, y, DIRECTION_CODES.index(d))
+
+        return mapcache.MapFields(terrain, distance, water_dir, available)
+
     def get_neighbours(self, position):
         """
         Returns all the valid neighbouring tiles
@@ -475,3 +762,84 @@ class World:
         """
         x, y = position
         return [(d, (x + dx, y + dy)) for d, (dx, dy) in DIRECTIONS.items() if self.is_valid((x + dx, y + dy))]
+
+
+# Changes whenever the map generation or the encoding of the fields does, invalidating cached maps
+MAP_VERSION = mapcache.source_digest(World.generate_terrain, World.compute_fields, World.compute_distances,
+                                     World.get_neighbours, World.is_valid, TERRAIN_CODES, DIRECTIONS,
+                                     DIRECTION_CODES, AVAILABLE_SETS, *mapcache.encoding())
+
+
+# Parallel update -----------------------------------------------------
+
+# Map used by the blips in a worker process
+worker_world = None
+
+
+def init_worker(dimensions, cache, fields, settings):
+    """
+    Prepares a worker process for the parallel update.
+
+    :param dimensions: A tuple (width, height) of the map
+    :param cache: A tuple (cache_dir, key) to map the fields from, None to use the given fields
+    :param fields: The MapFields of the map if there's no cache
+    :param settings: The simulation parameters
+    """
+    global worker_world
+    vars(params).update(settings)
+    if cache:
+        fields = mapcache.load(cache[0], cache[1], MAP_VERSION)
+
+    # Only the static map is needed to sense the surroundings
+    worker_world = World.__new__(World)
+    worker_world.width, worker_world.height = dimensions
+    worker_world.terrain = fields.terrain
+    worker_world.water_distance = fields.distance
+    worker_world.water_directions = fields.water_dir
+    worker_world.available_directions = fields.available
+
+
+def resolve_partition(world, pairs, positions, seed, turn):
+    """
+    Decides and resolves the actions of a slice of the blips.
+    Every blip draws from a generator seeded by its id and the turn,
+    so the results don't depend on how the blips are partitioned.
+
+    :param world: The world, None in a worker process
+    :param pairs: A list of tuples (blip, position) for the blips in the slice
+    :param positions: Positions of all the blips
+    :param seed: Seed of the world
+    :param turn: Current turn
+    :return: A list of tuples (new position, strength change, vapors change, food request)
+    """
+    if world is None:
+        world = worker_world
+        world.blips = dict(pairs)
+
+    effects = []
+    for blip, _ in pairs:
+        rng = random.Random((seed * 1000003 + turn) * 1000003 + blip.id)
+        command, arg = blip.decide_action(world.build_state(blip, positions), rng)
+        effects.append(world.resolve_action(blip, command, arg))
+
+    return effects
+
+
+def share_food(available, requests):
+    """
+    Splits the food of a tile between the blips that eat from it.
+    Smaller requests are filled first and the rest is split evenly,
+    ties are broken by blip id.
+
+    :param available: Food on the tile
+    :param requests: A list of tuples (quantity, blip id)
+    :return: The granted quantities, in the order of the requests
+    """
+    grants = [0 for _ in requests]
+    order = sorted(range(len(requests)), key=lambda i: requests[i])
+    for n, i in enumerate(order):
+        share = available // (len(order) - n)
+        grants[i] = min(requests[i][0], share)
+        available -= grants[i]
+
+    return grants